@@ -1,5 +1,6 @@
-from pydoc import render_doc
 import streamlit as st
+import pandas as pd
+from typing import Dict, List, Optional, Tuple
 from data import load_data
 from utils import (
     MANUAL_SORT_COLS,
@@ -7,10 +8,139 @@ from utils import (
     INTRO_PARAGRAPH,
     FILTER_VALS,
     COL_NAMES,
+    LABELS,
+    box_stats,
 )
 
 import plotly.figure_factory as ff
 import plotly.express as px
+import plotly.graph_objects as go
+
+
+@st.cache_data
+def prepare_render_df(
+    df: pd.DataFrame, option: str
+) -> Tuple[pd.DataFrame, Optional[Dict[str, List]]]:
+    """Filters and sorts the survey data for plotting against a column.
+
+    The result is cached, so switching back to an already visited comparison
+    variable does not redo the filtering.
+
+    Args:
+        df (Pandas Dataframe):
+            The survey data.
+        option (str):
+            The column to compare salaries across.
+
+    Returns:
+        pair of Pandas Dataframe and dict or None:
+            The data to plot and the category order to plot it in, if any.
+    """
+
+    # Remove irrelevant values i.e. "Other", "Prefer not to say", as well as
+    # values with <5 entries
+    grouped = df.groupby(option, observed=True, sort=False)
+    keep = ~df[option].isin(FILTER_VALS) & (grouped["salary"].transform("size") > 5)
+
+    # Remove clutter from columns that are sorted manually
+    if option in MANUAL_SORT_COLS:
+        keep &= df[option].isin(MANUAL_SORT_COLS[option])
+
+    render_df = df.loc[keep]
+
+    # Drop the filtered categories, so they are not grouped on below
+    if hasattr(render_df[option], "cat"):
+        render_df = render_df.copy()
+        render_df[option] = render_df[option].cat.remove_unused_categories()
+
+    # Sort values based on median salary
+    sort_order = None
+    if option in MEDIAN_SORT_COLS:
+        grouped = render_df.groupby(option, observed=True, sort=False)
+        sort_order = {option: grouped["salary"].median().sort_values().index.tolist()}
+
+    # Sort values manually
+    if option in MANUAL_SORT_COLS:
+        sort_order = MANUAL_SORT_COLS
+
+    return render_df, sort_order
+
+
+@st.cache_resource
+def make_box_plot(
+    render_df: pd.DataFrame,
+    option: str,
+    sort_order: Optional[Dict[str, List]],
+) -> go.Figure:
+    """Creates a box plot of the salaries for each value of a column.
+
+    Only the box plot statistics of each group are passed on to Plotly, rather
+    than every single salary. The figure is cached, so revisiting a comparison
+    variable reuses the figure that was built for it the first time.
+
+    Args:
+        render_df (Pandas Dataframe):
+            The data to plot.
+        option (str):
+            The column to compare salaries across.
+        sort_order (dict or None):
+            The category order to plot the values of `option` in, if any.
+
+    Returns:
+        Plotly Figure:
+            The box plot.
+    """
+    # Compute the box plot statistics of each value. There might not be any
+    # values left at all, if they all have too few entries
+    stats = pd.DataFrame(columns=["q1", "median", "q3", "lowerfence", "upperfence"])
+    if not render_df.empty:
+        grouped = render_df.groupby(option, observed=True, sort=False)
+        stats = grouped["salary"].apply(box_stats).unstack()
+
+    # Put the values with a manual or median sort order first, and otherwise
+    # keep the order in which they appear in the data
+    category_order = [] if sort_order is None else list(sort_order[option])
+    category_order += [val for val in stats.index if val not in category_order]
+    stats = stats.reindex([val for val in category_order if val in stats.index])
+
+    # Colour the values by their position in the category order
+    colors = px.colors.diverging.Tealrose
+    color_map = {
+        val: colors[idx % len(colors)] for idx, val in enumerate(category_order)
+    }
+
+    hovertemplate = (
+        f"{LABELS[option]}=%{{x}}<br>{LABELS['salary']}=%{{y}}<extra></extra>"
+    )
+    fig = go.Figure(
+        [
+            go.Box(
+                name=str(val),
+                x=[val],
+                q1=[row["q1"]],
+                median=[row["median"]],
+                q3=[row["q3"]],
+                lowerfence=[row["lowerfence"]],
+                upperfence=[row["upperfence"]],
+                boxpoints=False,
+                marker_color=color_map[val],
+                hovertemplate=hovertemplate,
+            )
+            for val, row in stats.iterrows()
+        ]
+    )
+    fig.update_layout(
+        boxmode="overlay",
+        showlegend=False,
+        xaxis=dict(
+            title=LABELS[option],
+            categoryorder="array",
+            categoryarray=category_order,
+        ),
+        yaxis_title=LABELS["salary"],
+    )
+    return fig
+
 
 if __name__ == "__main__":
     st.set_page_config(page_title="DDSC Salary Survey Dashboard", layout="wide")
@@ -30,50 +160,17 @@ if __name__ == "__main__":
         selected = st.selectbox("Comparison variable", COL_NAMES.keys())
         option = COL_NAMES[selected]
 
-        # Remove irrelevant values i.e. "Other", "Prefer not to say"
-        render_df = df[~df[option].isin(FILTER_VALS)]
-
-        # Remove values with <5 entries
-        grouped_df = render_df.groupby(option).agg({"salary": "count"})
-        allowed_vals = grouped_df[grouped_df.salary > 5].index.tolist()
-        render_df = render_df[render_df[option].isin(allowed_vals)]
+        # Filter and sort the data for the selected comparison variable
+        render_df, sort_order = prepare_render_df(df, option)
 
     # TODO: Display more information on selected category. Maybe also the wording of the question from the survey?
 
-    # Sort values based on median salary
-    sort_order = None
-    if option in MEDIAN_SORT_COLS:
-        sort_order = {
-            option: render_df.groupby(option)
-            .agg({"salary": "median"})
-            .sort_values("salary")
-            .index.tolist()
-        }
-
-    # Sort values manually and remove clutter
-    if option in MANUAL_SORT_COLS:
-        render_df = render_df[render_df[option].isin(MANUAL_SORT_COLS[option])]
-        sort_order = MANUAL_SORT_COLS
-
-    # More readable plot labels
-    labels = {**{"salary": "Salary"}, **{v: k for k, v in COL_NAMES.items()}}
-
     # Allows for adjusting page width
     _, col, _ = st.columns([1, 10, 1])
 
     with col:
 
         # Plot
-        fig = px.box(
-            render_df,
-            x=option,
-            y="salary",
-            points=False,
-            color=option,
-            color_discrete_sequence=px.colors.diverging.Tealrose,
-            category_orders=sort_order,
-            labels=labels,
-        )
-        fig.update_layout(showlegend=False)
+        fig = make_box_plot(render_df, option, sort_order)
 
         st.plotly_chart(fig, use_container_width=True)
@@ -1,16 +1,170 @@
 """Script containing data loading scripts"""
 
+import re
 import pandas as pd
+import numpy as np
 from pathlib import Path
 from typing import Union
 import streamlit as st
-from b2sdk.v2 import B2Api, DoNothingProgressListener
 import os
 
+# Mapping from the survey questions to the column names used in the dataframe
+RENAME_MAP = {
+    "Timestamp": "timestamp",
+    "What is your monthly salary in DKK, before tax and including pension?": "salary",
+    "How much bonus did you receive last year, in DKK?": "bonus",
+    "Have you received any equity in your company?": "received_equity",
+    "What job title best reflects your daily work?": "job_title",
+    "What tools do you use in your daily work?": "tools",
+    "How many people are employed at your work?": "num_employees",
+    "How many people are you managing at your work?": "num_subordinates",
+    "In which sector do you work?": "sector",
+    "In which Danish region is your office located?": "region",
+    "What educational background do you have?": "educational_background",
+    "What is your highest level of education?": "highest_education",
+    "How many years of relevant full-time work experience do you have?": "years_experience",
+    "What is your gender?": "gender",
+    "Are you a Danish national/citizen?": "danish_national",
+}
 
+# Manual fixes of incorrect salary values, being either given in thousands of
+# DKK or as a yearly salary
+SALARY_FIX = {
+    56: 56000,
+    65: 65000,
+    700000: 700000 // 12,
+    720000: 720000 // 12,
+    1000000: 1000000 // 12,
+}
+
+# Version of the preprocessing, which is part of the name of the parquet file
+# that the preprocessed data is stored in. Bump this whenever the preprocessing
+# changes, so that data preprocessed by an older version is not used
+PREPROCESSING_VERSION = 1
+
+# Datatypes of the preprocessed columns, besides the Boolean tool columns
+DTYPES = dict(
+    salary="int32",
+    bonus="int32",
+    received_equity="category",
+    job_title="category",
+    num_employees="category",
+    num_subordinates="category",
+    sector="category",
+    region="category",
+    educational_background="category",
+    highest_education="category",
+    years_experience="int8",
+    gender="category",
+    danish_national="category",
+)
+
+
+def _download_data(data_dir: Path) -> str:
+    """Downloads the survey data from Backblaze.
+
+    Args:
+        data_dir (Path):
+            The directory to store the data in.
+
+    Returns:
+        str:
+            The path to the downloaded csv file.
+    """
+    # Only import the Backblaze SDK when the data actually needs to be fetched
+    from b2sdk.v2 import B2Api, DoNothingProgressListener
+
+    b2_api = B2Api()
+    application_key_id = os.environ.get("APP_KEY_ID")
+    application_key = os.environ.get("APP_KEY")
+    file_id = os.environ.get("FILE_ID")
+    b2_api.authorize_account("production", application_key_id, application_key)
+
+    progress_listener = DoNothingProgressListener()
+    downloaded_file = b2_api.download_file_by_id(file_id, progress_listener)
+    data_path = str(data_dir) + "/survey_results.csv"
+    downloaded_file.save_to(data_path)
+
+    return data_path
+
+
+def _merge_categories(series: pd.Series, mapping: dict) -> pd.Series:
+    """Merges values of a categorical column.
+
+    The mapping is applied to the categories of the column rather than to each
+    of its values, and categories that end up with the same name are merged.
+
+    Args:
+        series (Pandas Series):
+            The categorical column.
+        mapping (dict):
+            Mapping from the values to merge to their new value. Values not in
+            the mapping are kept as they are.
+
+    Returns:
+        Pandas Series:
+            The categorical column with the merged values.
+    """
+    renamed = series.cat.categories.map(lambda cat: mapping.get(cat, cat))
+    categories = renamed.unique().sort_values()
+
+    # Missing values have code -1, which is mapped to the appended -1
+    new_codes = np.append(categories.get_indexer(renamed), -1)
+    codes = new_codes[series.cat.codes.to_numpy()]
+    return pd.Series(
+        pd.Categorical.from_codes(codes, categories),
+        index=series.index,
+        name=series.name,
+    )
+
+
+def _parse_timestamps(timestamps: pd.Series) -> pd.Series:
+    """Parses the Google Forms timestamps as UTC datetimes.
+
+    The timestamps are of the form "2022/03/14 9:01:32 AM GMT+1". Their "GMT",
+    "GMT+1" or "GMT+5:30" suffix is converted to a UTC offset, so that they
+    can all be parsed with a single fixed format, which is much faster than
+    letting pandas guess the format of every timestamp. We only fall back to
+    guessing if some of the timestamps are not in that format, in which case
+    the UTC offsets are still used.
+
+    Args:
+        timestamps (Pandas Series):
+            The timestamp strings.
+
+    Returns:
+        Pandas Series:
+            The parsed timestamps.
+    """
+
+    def to_utc_offset(match: re.Match) -> str:
+        sign, hours, minutes = match.group(1, 2, 3)
+        return f"{sign or '+'}{int(hours or 0):02d}{minutes or '00'}"
+
+    offset_timestamps = timestamps.str.replace(
+        r"GMT([+-])?(\d{1,2})?(?::(\d{2}))?$", to_utc_offset, regex=True
+    )
+    try:
+        return pd.to_datetime(
+            offset_timestamps, format="%Y/%m/%d %I:%M:%S %p %z", utc=True
+        )
+    except ValueError:
+        # Guessing the format of each timestamp requires `format="mixed"` from
+        # pandas 2.0 onwards
+        mixed = dict(format="mixed") if int(pd.__version__.split(".")[0]) >= 2 else {}
+        return pd.to_datetime(offset_timestamps, utc=True, **mixed)
+
+
+@st.cache_data(show_spinner="Fetching data")
 def load_data(data_dir: Union[str, Path] = "data") -> pd.DataFrame:
     """Loads the survey data as a dataframe.
 
+    The result is cached, so the data is only loaded and preprocessed once per
+    `data_dir`, rather than on every rerun of the dashboard. The preprocessed
+    data is furthermore stored as a parquet file in `data_dir`, which is used
+    on subsequent loads for as long as it is newer than the raw csv file and
+    was created with the current `PREPROCESSING_VERSION`.
+
     Args:
         data_dir (str or Path):
             The directory containing the data.
@@ -23,54 +177,35 @@ def load_data(data_dir: Union[str, Path] = "data") -> pd.DataFrame:
     # Ensure that `data_dir` is a Path object
     data_dir = Path(data_dir)
 
-    # Check if csv file exists locally
+    # Use the preprocessed parquet file if it is newer than the raw csv file
+    parquet_path = data_dir / f"survey_results_v{PREPROCESSING_VERSION}.parquet"
     csv_files = list(data_dir.glob("*.csv"))
+    if parquet_path.exists() and all(
+        csv_file.stat().st_mtime <= parquet_path.stat().st_mtime
+        for csv_file in csv_files
+    ):
+        return pd.read_parquet(parquet_path).astype(DTYPES)
+
+    # Check if csv file exists locally, otherwise fetch it from Backblaze
     if len(csv_files) > 0:
         data_path = csv_files[0]
-
-    # Fetch csv file from Backblaze
     else:
-        with st.spinner("Fetching data"):
-            b2_api = B2Api()
-            application_key_id = os.environ.get("APP_KEY_ID")
-            application_key = os.environ.get("APP_KEY")
-            file_id = os.environ.get("FILE_ID")
-            b2_api.authorize_account("production", application_key_id, application_key)
-
-            progress_listener = DoNothingProgressListener()
-            downloaded_file = b2_api.download_file_by_id(file_id, progress_listener)
-            data_path = str(data_dir) + "/survey_results.csv"
-            downloaded_file.save_to(data_path)
+        data_path = _download_data(data_dir)
 
     # Load the data
-    df = pd.read_csv(data_path)
+    df = pd.read_csv(
+        data_path,
+        usecols=list(RENAME_MAP.keys()) + ["Do you agree to take part in this survey?"],
+    )
 
     # Discard those who did not want to partake and remove the question
-    consent = df["Do you agree to take part in this survey?"]
-    df = df.query('@consent == "I am happy to take part in this survey"').drop(
-        columns=["Do you agree to take part in this survey?"]
+    consent_col = "Do you agree to take part in this survey?"
+    df = df.loc[df[consent_col] == "I am happy to take part in this survey"].drop(
+        columns=[consent_col]
     )
 
     # Rename cols
-    df = df.rename(
-        columns={
-            "Timestamp": "timestamp",
-            "What is your monthly salary in DKK, before tax and including pension?": "salary",
-            "How much bonus did you receive last year, in DKK?": "bonus",
-            "Have you received any equity in your company?": "received_equity",
-            "What job title best reflects your daily work?": "job_title",
-            "What tools do you use in your daily work?": "tools",
-            "How many people are employed at your work?": "num_employees",
-            "How many people are you managing at your work?": "num_subordinates",
-            "In which sector do you work?": "sector",
-            "In which Danish region is your office located?": "region",
-            "What educational background do you have?": "educational_background",
-            "What is your highest level of education?": "highest_education",
-            "How many years of relevant full-time work experience do you have?": "years_experience",
-            "What is your gender?": "gender",
-            "Are you a Danish national/citizen?": "danish_national",
-        }
-    )
+    df = df.rename(columns=RENAME_MAP)
 
     # Split the `tools` column into a separate Boolean column for each tool.
     # Note that this effectively removes the 'custom' tool options that people
@@ -88,21 +223,29 @@ def load_data(data_dir: Union[str, Path] = "data") -> pd.DataFrame:
         uses_automl_tools="AutoML / Low-code / No-code tools (e.g., PyCaret, TPOT, Google AutoML, Azure ML)",
         uses_rpa_tools="RPA tools (e.g., Zaptest, Eggplant, HelpSystems)",
     )
-    for name, desc in tools.items():
-        df[name] = df.tools.str.split(";").map(lambda lst: desc in lst)
-    df.drop(columns="tools", inplace=True)
+    dummies = (
+        df.tools.str.get_dummies(sep=";")
+        .astype(bool)
+        .reindex(columns=list(tools.values()), fill_value=False)
+        .rename(columns={desc: name for name, desc in tools.items()})
+    )
+    df = pd.concat([df.drop(columns="tools"), dummies], axis=1)
 
     # Convert the 'timestamp' column to a datetime format, rather than simply a
     # datetime string
-    df["timestamp"] = pd.to_datetime(df["timestamp"])
+    df["timestamp"] = _parse_timestamps(df["timestamp"])
 
-    # Duplicate years_experience col and convert to numeric. NB! 15+ years will
-    # simply be 15
-    df["years_experience"] = df.years_experience.str.replace(r"\D", "", regex=True)
-    df["years_experience"] = pd.to_numeric(df.years_experience)
+    # Extract the number of years from years_experience. NB! 15+ years will
+    # simply be 15, and "Less than a year" is converted to nan and then to 0
+    years = df.years_experience.str.extract(r"(\d+)", expand=False)
+    df["years_experience"] = pd.to_numeric(years).fillna(0)
 
-    # "Less than a year" is converted to nan. Convert nan to 0
-    df["years_experience"] = df.years_experience.fillna(0)
+    # Manually fix incorrect salary values
+    df = df[df.salary > 0]
+    df["salary"] = df.salary.map(SALARY_FIX).fillna(df.salary).astype(int)
+
+    # Set up datatypes
+    df = df.astype(DTYPES)
 
     # Replace gender strings for easier processing
     gender_map = {
@@ -111,30 +254,26 @@ def load_data(data_dir: Union[str, Path] = "data") -> pd.DataFrame:
         "Male as defined by the presence of an X- and a Y-chromosome": "male",
         "Prefer not to say": "no answer",
     }
-    df = df.replace({"gender": gender_map})
-
-    # Manually fix incorrect salary values
-    df = df[df.salary > 0]
-    df.loc[df["salary"] == 56, "salary"] = 56000
-    df.loc[df["salary"] == 65, "salary"] = 65000
-    df.loc[df["salary"] == 700000, "salary"] = int(700000 / 12)
-    df.loc[df["salary"] == 720000, "salary"] = int(720000 / 12)
-    df.loc[df["salary"] == 1000000, "salary"] = int(1000000 / 12)
+    df["gender"] = _merge_categories(df.gender, gender_map)
 
     # Merge sector values
-    df["sector"] = df["sector"].apply(
-        lambda sector: "Pharmaceuticals" if "pharma" in sector.lower() else sector
-    )
     sector_map = {
-        "University": "Education/Research",
-        "Research": "Education/Research",
-        "Trading company (Preowned Medical Equipment)": "Retail/E-commerce",
-        "Consumer industries": "Retail/E-commerce",
-        "Agency": "Consulting",
-        "Jobportaler": "Tech",
-        "Union": "Law",
+        sector: "Pharmaceuticals"
+        for sector in df.sector.cat.categories
+        if "pharma" in sector.lower()
     }
-    df = df.replace({"sector": sector_map})
+    sector_map.update(
+        {
+            "University": "Education/Research",
+            "Research": "Education/Research",
+            "Trading company (Preowned Medical Equipment)": "Retail/E-commerce",
+            "Consumer industries": "Retail/E-commerce",
+            "Agency": "Consulting",
+            "Jobportaler": "Tech",
+            "Union": "Law",
+        }
+    )
+    df["sector"] = _merge_categories(df.sector, sector_map)
 
     # Merge educational_background values
     educational_background_map = {
@@ -143,7 +282,9 @@ def load_data(data_dir: Union[str, Path] = "data") -> pd.DataFrame:
         "It teknolog": "Computer Science",
         "Physics": "Natural Sciences",
     }
-    df = df.replace({"educational_background": educational_background_map})
+    df["educational_background"] = _merge_categories(
+        df.educational_background, educational_background_map
+    )
 
     # Merge highest_education values
     highest_education_map = {
@@ -151,23 +292,15 @@ def load_data(data_dir: Union[str, Path] = "data") -> pd.DataFrame:
         "Dr.scient.": "PhD",
         "DrMedSc": "PhD",
     }
-
-    # Set up datatypes
-    dtypes = dict(
-        salary="int",
-        bonus="int",
-        received_equity="category",
-        job_title="category",
-        num_employees="category",
-        num_subordinates="category",
-        sector="category",
-        region="category",
-        educational_background="category",
-        highest_education="category",
-        years_experience="int",
-        gender="category",
-        danish_national="category",
+    df["highest_education"] = _merge_categories(
+        df.highest_education, highest_education_map
     )
-    df = df.astype(dtypes)
+
+    # Store the preprocessed data, to skip the preprocessing on the next load,
+    # and remove the data stored by other versions of the preprocessing
+    for stale_path in data_dir.glob("survey_results*.parquet"):
+        if stale_path != parquet_path:
+            stale_path.unlink()
+    df.to_parquet(parquet_path)
 
     return df
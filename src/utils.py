@@ -1,5 +1,7 @@
 from pathlib import Path
 import base64
+import numpy as np
+import pandas as pd
 
 # Column names used on dashboard for readability
 COL_NAMES = {
@@ -24,6 +26,9 @@ COL_NAMES = {
     "[Tools] AutoML": "uses_automl_tools",
 }
 
+# Readable plot labels of the columns
+LABELS = {"salary": "Salary", **{v: k for k, v in COL_NAMES.items()}}
+
 # Columns with an intuitive order - manually set below
 MANUAL_SORT_COLS = {
     "received_equity": ["Yes", "No"],
@@ -59,6 +64,37 @@ MEDIAN_SORT_COLS = ["job_title", "sector", "region", "educational_background"]
 # Values to remove for appearance
 FILTER_VALS = ["Other", "Prefer not to say"]
 
+
+def box_stats(salaries: pd.Series) -> pd.Series:
+    """Computes the box plot statistics of a group of salaries.
+
+    The quartiles and fences are computed in the same way as Plotly does when
+    it is given the raw salaries.
+
+    Args:
+        salaries (Pandas Series):
+            The salaries in the group.
+
+    Returns:
+        Pandas Series:
+            The quartiles and the lower and upper fences of the salaries.
+    """
+    values = np.sort(salaries.to_numpy())
+    positions = np.array([0.25, 0.5, 0.75]) * len(values) - 0.5
+    positions = positions.clip(0, len(values) - 1)
+    q1, median, q3 = np.interp(positions, np.arange(len(values)), values)
+    iqr = q3 - q1
+    return pd.Series(
+        dict(
+            q1=q1,
+            median=median,
+            q3=q3,
+            lowerfence=min(q1, values[values >= q1 - 1.5 * iqr].min()),
+            upperfence=max(q3, values[values <= q3 + 1.5 * iqr].max()),
+        )
+    )
+
+
 assets_path = str(Path(__file__).parent.parent) + "/assets"
 encode_img = lambda path: base64.b64encode(Path(path).read_bytes()).decode()
 
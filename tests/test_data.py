@@ -1,15 +1,25 @@
 """Unit tests for the data module"""
 
+import os
 import pytest
-from src.data import load_data
+import shutil
+import pandas as pd
+import src.data
+from src.data import load_data, _merge_categories, _parse_timestamps
 
 
 class TestData:
     """Test the data module"""
 
     @pytest.fixture(scope="class")
-    def df(self):
-        yield load_data("tests/data")
+    def data_dir(self, tmp_path_factory):
+        data_dir = tmp_path_factory.mktemp("data")
+        shutil.copy("tests/data/test_survey_results.csv", data_dir)
+        yield data_dir
+
+    @pytest.fixture(scope="class")
+    def df(self, data_dir):
+        yield load_data(data_dir)
 
     def test_no_consent_column(self, df):
         """Check that the consent column has been removed"""
@@ -52,8 +62,8 @@ class TestData:
         """Check that the column types are correct"""
         col_types = dict(
             timestamp="datetime64[ns, UTC]",
-            salary="int",
-            bonus="int",
+            salary="int32",
+            bonus="int32",
             received_equity="category",
             job_title="category",
             num_employees="category",
@@ -62,7 +72,7 @@ class TestData:
             region="category",
             educational_background="category",
             highest_education="category",
-            years_experience="int",
+            years_experience="int8",
             gender="category",
             danish_national="category",
             uses_high_level_language="bool",
@@ -77,5 +87,176 @@ class TestData:
             uses_automl_tools="bool",
             uses_rpa_tools="bool",
         )
-        for col_name, dtype in df.dtypes.iteritems():
+        for col_name, dtype in df.dtypes.items():
             assert col_types[col_name] == dtype
+
+    def test_tools_split(self, df):
+        """Check that the tools have been split into Boolean columns"""
+        row = df.iloc[0]
+        assert row.uses_high_level_language
+        assert row.uses_visualisation_tools
+        assert not row.uses_mid_level_language
+        assert not row.uses_rpa_tools
+
+    def test_parquet_cache(self, df, data_dir):
+        """Check that the preprocessed data is stored and reloaded as parquet"""
+        version = src.data.PREPROCESSING_VERSION
+        assert (data_dir / f"survey_results_v{version}.parquet").exists()
+        load_data.clear()
+        cached_df = load_data(data_dir)
+        assert cached_df.equals(df)
+        assert cached_df.dtypes.equals(df.dtypes)
+
+    def test_merged_values(self, df):
+        """Check that the categorical values have been merged"""
+        assert df.gender.iloc[0] == "male"
+        assert list(df.gender.cat.categories) == ["male"]
+
+    def test_parquet_cache_version(self, tmp_path, monkeypatch):
+        """Check that parquet files from other preprocessing versions are ignored"""
+        shutil.copy("tests/data/test_survey_results.csv", tmp_path)
+        version = src.data.PREPROCESSING_VERSION
+        (tmp_path / f"survey_results_v{version}.parquet").write_bytes(b"stale")
+        monkeypatch.setattr(src.data, "PREPROCESSING_VERSION", version + 1)
+        df = load_data(tmp_path)
+        assert len(df) == 1
+        assert (tmp_path / f"survey_results_v{version + 1}.parquet").exists()
+
+    def test_parquet_cache_stale_versions(self, tmp_path):
+        """Check that parquet files from other preprocessing versions are removed"""
+        shutil.copy("tests/data/test_survey_results.csv", tmp_path)
+        stale_paths = [
+            tmp_path / "survey_results.parquet",
+            tmp_path / f"survey_results_v{src.data.PREPROCESSING_VERSION - 1}.parquet",
+        ]
+        for stale_path in stale_paths:
+            stale_path.write_bytes(b"stale")
+        load_data(tmp_path)
+        assert [path.name for path in tmp_path.glob("*.parquet")] == [
+            f"survey_results_v{src.data.PREPROCESSING_VERSION}.parquet"
+        ]
+
+    def test_parquet_cache_newer_csv(self, tmp_path):
+        """Check that a csv file newer than the parquet file is preprocessed"""
+        csv_path = tmp_path / "survey_results.csv"
+        shutil.copy("tests/data/test_survey_results.csv", csv_path)
+        assert load_data(tmp_path).salary.tolist() == [50000]
+
+        # Change the salary and make the csv file newer than the parquet file
+        csv_path.write_text(csv_path.read_text().replace('"50000"', '"60000"'))
+        parquet_path = next(tmp_path.glob("*.parquet"))
+        mtime = parquet_path.stat().st_mtime + 10
+        os.utime(csv_path, (mtime, mtime))
+
+        load_data.clear()
+        assert load_data(tmp_path).salary.tolist() == [60000]
+        assert pd.read_parquet(parquet_path).salary.tolist() == [60000]
+
+
+class TestMergeCategories:
+    """Test the merging of categorical values"""
+
+    @pytest.fixture(scope="class")
+    def df(self, tmp_path_factory):
+        data_dir = tmp_path_factory.mktemp("data")
+        raw_df = pd.read_csv("tests/data/test_survey_results.csv")
+        raw_df = raw_df.loc[raw_df.index.repeat(5)].reset_index(drop=True)
+        raw_df["In which sector do you work?"] = [
+            "Pharma company",
+            "pharmaceuticals",
+            "University",
+            "Research",
+            "Tech",
+        ]
+        raw_df["What is your highest level of education?"] = [
+            "Dr.scient.",
+            "DrMedSc",
+            "Doing my Master's",
+            "PhD",
+            "Master's (kandidat)",
+        ]
+        raw_df.to_csv(data_dir / "survey_results.csv", index=False)
+        yield load_data(data_dir)
+
+    def test_many_to_one(self):
+        """Check that several values can be merged into the same value"""
+        series = pd.Series(["University", "Research", "Tech"], dtype="category")
+        merged = _merge_categories(
+            series,
+            {"University": "Education/Research", "Research": "Education/Research"},
+        )
+        assert merged.tolist() == ["Education/Research", "Education/Research", "Tech"]
+        assert merged.cat.categories.tolist() == ["Education/Research", "Tech"]
+
+    def test_missing_values(self):
+        """Check that missing values are kept as missing"""
+        series = pd.Series(["University", None, "Tech"], dtype="category")
+        merged = _merge_categories(series, {"University": "Education/Research"})
+        assert merged.isna().tolist() == [False, True, False]
+        assert merged.dropna().tolist() == ["Education/Research", "Tech"]
+
+    def test_sector(self, df):
+        """Check that the pharma and research sectors are merged"""
+        assert df.sector.tolist() == [
+            "Pharmaceuticals",
+            "Pharmaceuticals",
+            "Education/Research",
+            "Education/Research",
+            "Tech",
+        ]
+        assert df.sector.cat.categories.tolist() == [
+            "Education/Research",
+            "Pharmaceuticals",
+            "Tech",
+        ]
+
+    def test_highest_education(self, df):
+        """Check that the custom education levels are merged"""
+        assert df.highest_education.tolist() == [
+            "PhD",
+            "PhD",
+            "Undergraduate (e.g., bachelor, professionsbachelor)",
+            "PhD",
+            "Master's (kandidat)",
+        ]
+
+
+class TestParseTimestamps:
+    """Test the parsing of the Google Forms timestamps"""
+
+    def test_utc_offsets(self):
+        """Check that the GMT suffixes are parsed as UTC offsets"""
+        timestamps = pd.Series(
+            [
+                "2022/03/14 9:01:32 PM GMT",
+                "2022/03/14 9:01:32 AM GMT+1",
+                "2022/03/14 9:01:32 AM GMT-2",
+                "2022/03/14 12:01:32 am GMT+5:30",
+            ]
+        )
+        expected = pd.Series(
+            pd.to_datetime(
+                [
+                    "2022-03-14 21:01:32",
+                    "2022-03-14 08:01:32",
+                    "2022-03-14 11:01:32",
+                    "2022-03-13 18:31:32",
+                ]
+            ).tz_localize("UTC")
+        )
+        assert _parse_timestamps(timestamps).equals(expected)
+
+    def test_fallback(self):
+        """Check that timestamps not in the Google Forms format are parsed"""
+        timestamps = pd.Series(["2022/01/01 00:00:00 am GMT"])
+        parsed = _parse_timestamps(timestamps)
+        assert parsed.iloc[0] == pd.Timestamp("2022-01-01", tz="UTC")
+
+    def test_fallback_offsets(self):
+        """Check that the fallback agrees with the fixed format on UTC offsets"""
+        timestamps = pd.Series(
+            ["2022/03/14 9:01:32 AM GMT+1", "2022-03-14 10:01:32 GMT+2"]
+        )
+        parsed = _parse_timestamps(timestamps)
+        assert str(parsed.dt.tz) == "UTC"
+        assert (parsed == pd.Timestamp("2022-03-14 08:01:32", tz="UTC")).all()
@@ -0,0 +1,29 @@
+"""Unit tests for the utils module"""
+
+import pandas as pd
+from src.utils import box_stats
+
+
+class TestBoxStats:
+    """Test the box plot statistics, which should match those of Plotly"""
+
+    def test_quartiles(self):
+        """Check that the quartiles are interpolated like in Plotly"""
+        stats = box_stats(pd.Series([4, 2, 3, 1]))
+        assert stats.to_dict() == dict(
+            q1=1.5, median=2.5, q3=3.5, lowerfence=1, upperfence=4
+        )
+
+    def test_fences(self):
+        """Check that the fences exclude salaries beyond 1.5 IQR"""
+        stats = box_stats(pd.Series([1000, 10, 20, 30, 40, 50, 60, 70, 80]))
+        assert stats.to_dict() == dict(
+            q1=27.5, median=50, q3=72.5, lowerfence=10, upperfence=80
+        )
+
+    def test_single_salary(self):
+        """Check that a single salary gives a degenerate box"""
+        stats = box_stats(pd.Series([50000]))
+        assert stats.to_dict() == dict(
+            q1=50000, median=50000, q3=50000, lowerfence=50000, upperfence=50000
+        )